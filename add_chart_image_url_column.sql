@@ -3,8 +3,31 @@
 
 ALTER TABLE stocks ADD COLUMN IF NOT EXISTS chart_image_url TEXT;
 
+-- SHA-256 of the uploaded chart, lets upload_charts_to_supabase.py skip unchanged files
+ALTER TABLE stocks ADD COLUMN IF NOT EXISTS chart_image_hash TEXT;
+
 -- Add comment for documentation
 COMMENT ON COLUMN stocks.chart_image_url IS 'Public URL to YTD chart image in Supabase Storage';
+COMMENT ON COLUMN stocks.chart_image_hash IS 'SHA-256 hex digest of the chart image last uploaded';
 
 -- Optional: Create index if you'll be querying by this column
 CREATE INDEX IF NOT EXISTS idx_stocks_chart_image_url ON stocks(chart_image_url) WHERE chart_image_url IS NOT NULL;
+
+-- Set chart URLs and hashes for many stocks in one UPDATE. Only these two
+-- columns are written, so identity columns like ticker and name are never
+-- touched. Called by upload_charts_to_supabase.py; returns the rows updated
+CREATE OR REPLACE FUNCTION set_chart_urls(charts JSONB)
+RETURNS INTEGER AS $$
+    WITH updated AS (
+        UPDATE stocks s
+        SET
+            chart_image_url = c.chart_image_url,
+            chart_image_hash = c.chart_image_hash
+        FROM JSONB_TO_RECORDSET(charts) AS c(id BIGINT, chart_image_url TEXT, chart_image_hash TEXT)
+        WHERE s.id = c.id
+        RETURNING s.id
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$ LANGUAGE sql;
+
+COMMENT ON FUNCTION set_chart_urls IS 'Bulk-updates chart_image_url and chart_image_hash from a JSON array of {id, chart_image_url, chart_image_hash}';
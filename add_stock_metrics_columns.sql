@@ -25,3 +25,122 @@ COMMENT ON COLUMN stocks.ytd_return IS 'Year-to-date return percentage';
 COMMENT ON COLUMN stocks.current_price IS 'Most recent closing price in CAD';
 COMMENT ON COLUMN stocks.first_price_2025 IS 'First closing price in 2025';
 COMMENT ON COLUMN stocks.price_updated_at IS 'Timestamp of last price update';
+
+-- First/latest 2025 close for the given companies: 2 values per company
+-- instead of every price row. Each side is an ORDER BY ... LIMIT 1 lookup,
+-- so with the covering (company_id, date) INCLUDE (close_price) index it is
+-- a single index-only seek per company
+CREATE OR REPLACE FUNCTION stock_price_endpoints(company_ids BIGINT[])
+RETURNS TABLE (
+    company_id BIGINT,
+    first_date DATE,
+    first_price DECIMAL(12, 4),
+    latest_date DATE,
+    latest_price DECIMAL(12, 4)
+) AS $$
+    SELECT
+        ids.id,
+        first_row.date,
+        first_row.close_price,
+        latest_row.date,
+        latest_row.close_price
+    FROM UNNEST(company_ids) AS ids(id)
+    CROSS JOIN LATERAL (
+        SELECT sp.date, sp.close_price
+        FROM stock_prices sp
+        WHERE sp.company_id = ids.id AND sp.date >= '2025-01-01'
+        ORDER BY sp.date
+        LIMIT 1
+    ) first_row
+    CROSS JOIN LATERAL (
+        SELECT sp.date, sp.close_price
+        FROM stock_prices sp
+        WHERE sp.company_id = ids.id AND sp.date >= '2025-01-01'
+        ORDER BY sp.date DESC
+        LIMIT 1
+    ) latest_row;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION stock_price_endpoints IS 'First and latest 2025 closing prices for the given companies';
+
+-- The same endpoints for every stock, for ad-hoc queries
+CREATE OR REPLACE VIEW stock_ytd_metrics AS
+SELECT
+    e.company_id,
+    e.first_price,
+    e.latest_price,
+    e.first_date,
+    e.latest_date
+FROM stock_price_endpoints(ARRAY(SELECT id::BIGINT FROM stocks)) e;
+
+COMMENT ON VIEW stock_ytd_metrics IS 'First and latest 2025 closing prices per company';
+
+-- Refresh the given stocks' YTD metrics in one set-oriented UPDATE
+-- Called by update_stock_metrics.py; returns the IDs of the stocks updated
+DROP FUNCTION IF EXISTS refresh_stock_ytd();
+DROP FUNCTION IF EXISTS refresh_stock_ytd(BIGINT[]);
+
+CREATE OR REPLACE FUNCTION refresh_stock_ytd(company_ids BIGINT[])
+RETURNS BIGINT[] AS $$
+    WITH updated AS (
+        UPDATE stocks s
+        SET
+            first_price_2025 = e.first_price,
+            current_price = e.latest_price,
+            ytd_return = CASE
+                WHEN e.first_price = 0 THEN 0
+                ELSE (e.latest_price - e.first_price) / e.first_price * 100
+            END,
+            price_updated_at = NOW()
+        FROM stock_price_endpoints(company_ids) e
+        WHERE s.id = e.company_id
+        RETURNING s.id
+    )
+    SELECT COALESCE(ARRAY_AGG(id::BIGINT), '{}') FROM updated;
+$$ LANGUAGE sql;
+
+COMMENT ON FUNCTION refresh_stock_ytd IS 'Recomputes ytd_return, current_price and first_price_2025 for the given stocks';
+
+-- IDs of stocks with prices stored or corrected since their metrics were
+-- last refreshed (or never refreshed), so update_stock_metrics.py can skip
+-- everything else. Keyed on stock_prices.updated_at (maintained by a trigger
+-- in create_stock_prices_table.sql) so corrected closes count too.
+-- Returned as one array so PostgREST's max-rows limit cannot truncate it
+CREATE OR REPLACE FUNCTION stocks_needing_ytd_refresh()
+RETURNS BIGINT[] AS $$
+    SELECT COALESCE(ARRAY_AGG(s.id::BIGINT), '{}')
+    FROM stocks s
+    WHERE EXISTS (
+        SELECT 1
+        FROM stock_prices sp
+        WHERE sp.company_id = s.id
+          AND sp.date >= '2025-01-01'
+          AND (s.price_updated_at IS NULL OR sp.updated_at > s.price_updated_at)
+    );
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION stocks_needing_ytd_refresh IS 'Stocks whose YTD metrics are older than their newest stored price';
+
+-- Average YTD return across every stock with metrics, for the
+-- update_stock_metrics.py report without paging the whole stocks table
+CREATE OR REPLACE FUNCTION stock_ytd_average()
+RETURNS DECIMAL AS $$
+    SELECT AVG(ytd_return) FROM stocks WHERE ytd_return IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION stock_ytd_average IS 'Average ytd_return over stocks that have YTD metrics';
+
+-- Number of stocks with no 2025 prices at all, which refresh_stock_ytd()
+-- cannot compute metrics for; reported separately by update_stock_metrics.py
+CREATE OR REPLACE FUNCTION count_stocks_without_ytd_prices()
+RETURNS INTEGER AS $$
+    SELECT COUNT(*)::INTEGER
+    FROM stocks s
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM stock_prices sp
+        WHERE sp.company_id = s.id AND sp.date >= '2025-01-01'
+    );
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION count_stocks_without_ytd_prices IS 'Stocks with no 2025 closing prices';
@@ -0,0 +1,24 @@
+-- Make the (company_id, date) index on stock_prices a covering index
+-- Run this in Supabase SQL Editor on databases created before
+-- create_stock_prices_table.sql added idx_stock_prices_company_date_close
+
+-- INCLUDE (close_price) lets the first/latest price lookups in the
+-- stock_ytd_metrics view read the price straight from the index
+CREATE INDEX IF NOT EXISTS idx_stock_prices_company_date_close
+ON stock_prices(company_id, date) INCLUDE (close_price);
+
+-- Superseded by the covering index above
+DROP INDEX IF EXISTS idx_stock_prices_company_date;
+
+ANALYZE stock_prices;
+
+-- Verify: both lookups should show "Index Only Scan using idx_stock_prices_company_date_close"
+-- EXPLAIN ANALYZE
+-- SELECT date, close_price FROM stock_prices
+-- WHERE company_id = 1 AND date >= '2025-01-01'
+-- ORDER BY date LIMIT 1;
+--
+-- EXPLAIN ANALYZE
+-- SELECT date, close_price FROM stock_prices
+-- WHERE company_id = 1 AND date >= '2025-01-01'
+-- ORDER BY date DESC LIMIT 1;
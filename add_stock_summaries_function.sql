@@ -0,0 +1,19 @@
+-- Bulk-save AI summaries for summarize_stocks.py
+-- Run this in Supabase SQL Editor before running summarize_stocks.py
+
+-- Set summary_ai for many stocks in one UPDATE. Only summary_ai is written,
+-- so identity columns like ticker and name are never touched. Returns the
+-- number of rows updated
+CREATE OR REPLACE FUNCTION set_stock_summaries(summaries JSONB)
+RETURNS INTEGER AS $$
+    WITH updated AS (
+        UPDATE stocks s
+        SET summary_ai = u.summary_ai
+        FROM JSONB_TO_RECORDSET(summaries) AS u(id BIGINT, summary_ai TEXT)
+        WHERE s.id = u.id
+        RETURNING s.id
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$ LANGUAGE sql;
+
+COMMENT ON FUNCTION set_stock_summaries IS 'Bulk-updates summary_ai from a JSON array of {id, summary_ai}';
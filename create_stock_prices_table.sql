@@ -7,6 +7,7 @@ CREATE TABLE IF NOT EXISTS stock_prices (
     date DATE NOT NULL,
     close_price DECIMAL(12, 4) NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
 
     -- Ensure one price per company per day
     CONSTRAINT unique_company_date UNIQUE (company_id, date)
@@ -15,10 +16,56 @@ CREATE TABLE IF NOT EXISTS stock_prices (
 -- Create indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_stock_prices_company_id ON stock_prices(company_id);
 CREATE INDEX IF NOT EXISTS idx_stock_prices_date ON stock_prices(date);
-CREATE INDEX IF NOT EXISTS idx_stock_prices_company_date ON stock_prices(company_id, date);
+-- Covering index: first/latest price lookups per company are index-only scans
+CREATE INDEX IF NOT EXISTS idx_stock_prices_company_date_close ON stock_prices(company_id, date) INCLUDE (close_price);
 
 -- Add comment for documentation
 COMMENT ON TABLE stock_prices IS 'Historical daily closing prices for stocks';
 COMMENT ON COLUMN stock_prices.company_id IS 'Foreign key to stocks table';
 COMMENT ON COLUMN stock_prices.date IS 'Trading date';
 COMMENT ON COLUMN stock_prices.close_price IS 'Closing price in CAD';
+COMMENT ON COLUMN stock_prices.updated_at IS 'When close_price was inserted or last changed';
+
+-- updated_at for databases created before the column existed (existing rows
+-- start at NOW(), which costs one extra full metrics refresh)
+ALTER TABLE stock_prices
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+-- Bump updated_at when an upsert corrects an existing day's close, so
+-- stocks_needing_ytd_refresh() picks the change up. Unchanged re-upserts
+-- keep the old timestamp and do not mark the stock stale
+CREATE OR REPLACE FUNCTION touch_stock_price_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.close_price IS DISTINCT FROM OLD.close_price THEN
+        NEW.updated_at = NOW();
+    ELSE
+        NEW.updated_at = OLD.updated_at;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stock_prices_touch_updated_at ON stock_prices;
+
+CREATE TRIGGER stock_prices_touch_updated_at
+BEFORE UPDATE ON stock_prices
+FOR EACH ROW EXECUTE FUNCTION touch_stock_price_updated_at();
+
+-- Latest stored price date per company
+-- Used by fetch_stock_prices.py to only fetch days it does not have yet.
+-- Returned as one {company_id: latest_date} object so PostgREST's max-rows
+-- limit cannot truncate it
+DROP FUNCTION IF EXISTS get_latest_price_dates();
+
+CREATE OR REPLACE FUNCTION get_latest_price_dates()
+RETURNS JSONB AS $$
+    SELECT COALESCE(JSONB_OBJECT_AGG(latest.company_id::TEXT, latest.latest_date), '{}')
+    FROM (
+        SELECT sp.company_id, MAX(sp.date) AS latest_date
+        FROM stock_prices sp
+        GROUP BY sp.company_id
+    ) latest;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION get_latest_price_dates IS 'Returns the most recent price date stored for each company';
@@ -253,6 +253,34 @@ $$ LANGUAGE plpgsql SECURITY DEFINER;
 
 COMMENT ON FUNCTION remove_from_watchlist IS 'Removes a stock from user watchlist';
 
+-- =====================================================================
+-- FUNCTION: get_random_stocks
+-- =====================================================================
+-- Returns a random sample of stocks, sampled server-side so only the
+-- requested rows cross the wire (used by test_user_tracking.py)
+-- Usage: SELECT * FROM get_random_stocks(10);
+-- =====================================================================
+
+CREATE OR REPLACE FUNCTION get_random_stocks(n INTEGER)
+RETURNS TABLE (
+    id BIGINT,
+    ticker TEXT,
+    name TEXT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        s.id,
+        s.ticker,
+        s.name
+    FROM stocks s
+    ORDER BY random()
+    LIMIT n;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION get_random_stocks IS 'Returns n randomly chosen stocks';
+
 -- =====================================================================
 -- COMPLETE!
 -- =====================================================================
@@ -9,18 +9,27 @@ Database Schema Required:
     - date (date)
     - close_price (decimal/numeric)
     - UNIQUE constraint on (company_id, date)
+- get_latest_price_dates() RPC (optional; enables incremental fetches)
 """
 
+import asyncio
+import logging
+import logging.handlers
 import os
-from datetime import datetime, date
-from typing import List, Dict, Any, Optional
+import random
+import sys
 import time
+from datetime import datetime, date, timedelta, timezone
+from queue import SimpleQueue
+from typing import List, Dict, Any, Optional, Tuple
 
-import yfinance as yf
+import aiohttp
 import pandas as pd
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
 from dotenv import load_dotenv
 
+from supabase_cache import apaged_select
+
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
@@ -30,114 +39,355 @@ load_dotenv()
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
 # Constants
 YTD_START_DATE = "2025-01-01"
 TODAY = date.today().strftime("%Y-%m-%d")
-BATCH_SIZE = 100  # Number of price records to upsert at once
+BATCH_SIZE = 1000  # Number of price records to upsert at once
+MIN_BATCH_SIZE = 100  # Smallest batch to split down to when Supabase rejects a payload as too large
+UPSERT_WORKERS = 4  # Concurrent upsert requests
+
+# Yahoo Finance chart endpoint (one symbol per request)
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+YAHOO_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; InvestMatch/1.0)"}
+YAHOO_TIMEOUT_SECONDS = 30
+MAX_CONCURRENT_REQUESTS = 64  # Chart requests in flight across all hosts
+MAX_CONNECTIONS_PER_HOST = 8  # Open connections to Yahoo at once
+YAHOO_REQUESTS_PER_SECOND = 4  # Sustained request rate allowed against Yahoo
+YAHOO_BURST = 8  # Requests allowed back-to-back before throttling kicks in
+RETRY_STATUS_CODES = {429, 503}  # Throttled / temporarily unavailable
+MAX_FETCH_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 30
+
+# Upsert progress is logged from concurrent upsert tasks; a QueueHandler
+# keeps those writes from blocking the event loop (see start_log_listener)
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------
+# Rate Limiting
+# ---------------------------------------------------------------------
+
+class TokenBucket:
+    """
+    Token bucket shared by all download tasks on the event loop.
+
+    Tokens refill at `rate` per second up to `capacity`; each request
+    takes one token and waits until one is available.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Holding the lock while sleeping hands out tokens in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# One bucket per host: every download goes to Yahoo Finance
+yahoo_rate_limiter = TokenBucket(YAHOO_REQUESTS_PER_SECOND, YAHOO_BURST)
 
 # ---------------------------------------------------------------------
 # Helper Functions
 # ---------------------------------------------------------------------
 
-def get_all_stocks() -> List[Dict[str, Any]]:
+def start_log_listener() -> logging.handlers.QueueListener:
+    """
+    Route this module's log records through an in-memory queue to stdout.
+
+    Logging threads only enqueue the record; a single listener thread does
+    the blocking write. Stop the returned listener to flush it.
+    """
+    log_queue: SimpleQueue = SimpleQueue()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+
+async def get_all_stocks(supabase: AsyncClient) -> List[Dict[str, Any]]:
     """
     Fetch all stocks from Supabase stocks table.
     Returns list of dicts with 'id' and 'ticker' keys.
     """
     print("Fetching stocks from Supabase...")
 
-    response = supabase.table("stocks").select("id, ticker").execute()
-    stocks = response.data
+    # Paged so catalogs past PostgREST's max-rows limit are not truncated
+    stocks = await apaged_select(lambda: supabase.table("stocks").select("id, ticker").order("id"))
 
     print(f"✅ Found {len(stocks)} stocks in database")
     return stocks
 
 
-def fetch_price_data(ticker: str, start_date: str, end_date: str) -> Optional[List[Dict[str, Any]]]:
+async def get_latest_price_dates(supabase: AsyncClient) -> Dict[int, str]:
+    """
+    Fetch the most recent stored price date for every company via the
+    get_latest_price_dates RPC (see create_stock_prices_table.sql).
+
+    Returns:
+        Dict mapping company_id to latest date (YYYY-MM-DD). Empty if the
+        RPC is unavailable, which makes the run fetch full YTD history.
+    """
+    try:
+        response = await supabase.rpc("get_latest_price_dates").execute()
+    except Exception as e:
+        print(f"⚠️  Could not load latest price dates, fetching full history: {e}")
+        return {}
+
+    # JSON object keys are strings; company IDs are ints everywhere else
+    return {int(company_id): latest_date for company_id, latest_date in (response.data or {}).items()}
+
+
+def get_fetch_start_date(latest_date: Optional[str]) -> str:
+    """
+    First date that still needs fetching for a company: the day after its
+    latest stored price, or the start of the year if it has none.
+    """
+    if latest_date is None:
+        return YTD_START_DATE
+
+    next_day = datetime.strptime(latest_date, "%Y-%m-%d").date() + timedelta(days=1)
+    return max(next_day.strftime("%Y-%m-%d"), YTD_START_DATE)
+
+
+def to_epoch_seconds(day: str) -> int:
+    """
+    Convert a YYYY-MM-DD date to a Unix timestamp at midnight UTC.
+    """
+    return int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def close_to_columns(close: pd.Series) -> Tuple[List[str], List[float]]:
     """
-    Fetch historical price data from Yahoo Finance.
+    Split a date-indexed Series of close prices (NaNs already dropped)
+    into parallel lists of YYYY-MM-DD dates and closing prices.
+    """
+    return close.index.strftime("%Y-%m-%d").tolist(), close.astype(float).tolist()
+
+
+def get_retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    """
+    Seconds to wait before retrying a throttled request: the server's
+    Retry-After when it sends one, otherwise exponential backoff with jitter.
+    """
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = 2 ** attempt + random.random()
+
+    return min(delay, MAX_BACKOFF_SECONDS)
+
+
+async def fetch_price_data(
+    http: aiohttp.ClientSession,
+    ticker: str,
+    start_date: str,
+    end_date: str
+) -> Optional[Tuple[List[str], List[float]]]:
+    """
+    Fetch historical price data from Yahoo Finance's chart endpoint.
 
     Args:
+        http: Shared aiohttp session
         ticker: Stock ticker (e.g., 'SHOP')
         start_date: Start date in YYYY-MM-DD format
-        end_date: End date in YYYY-MM-DD format
+        end_date: End date in YYYY-MM-DD format (exclusive)
 
     Returns:
-        List of dicts with 'date' and 'close' keys, or None if fetch fails
+        Tuple of parallel (dates, closes) lists (empty when Yahoo has no bars
+        in the range), or None if the fetch fails
+
+    Throttled responses (429/503) are retried up to MAX_FETCH_ATTEMPTS times.
     """
     # Add .TO suffix for TSX tickers
     yahoo_ticker = f"{ticker}.TO"
+    params = {
+        "period1": to_epoch_seconds(start_date),
+        "period2": to_epoch_seconds(end_date),
+        "interval": "1d",
+    }
 
     try:
-        stock = yf.Ticker(yahoo_ticker)
-        history = stock.history(start=start_date, end=end_date, interval="1d")
+        for attempt in range(MAX_FETCH_ATTEMPTS):
+            await yahoo_rate_limiter.acquire()
 
-        if history.empty:
+            async with http.get(YAHOO_CHART_URL.format(symbol=yahoo_ticker), params=params) as response:
+                throttled = response.status in RETRY_STATUS_CODES and attempt < MAX_FETCH_ATTEMPTS - 1
+
+                if not throttled:
+                    response.raise_for_status()
+                    payload = await response.json()
+                    break
+
+                delay = get_retry_delay(response.headers.get("Retry-After"), attempt)
+
+            print(f"  ⏳ Yahoo returned {response.status} for {yahoo_ticker}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+        results = (payload.get("chart") or {}).get("result") or []
+        if not results or not results[0].get("timestamp"):
             print(f"  ⚠️  No data returned for {yahoo_ticker}")
-            return None
+            return [], []
+
+        result = results[0]
+        closes = result["indicators"]["quote"][0].get("close") or []
 
-        # Convert to list of dicts
-        price_data = []
-        for timestamp, row in history.iterrows():
-            close_price = row.get("Close")
-            if close_price is not None and not pd.isna(close_price):
-                price_data.append({
-                    "date": timestamp.strftime("%Y-%m-%d"),
-                    "close": float(close_price)
-                })
+        # Bars are stamped in UTC; convert to the exchange's zone to get the trading date
+        exchange_tz = result.get("meta", {}).get("exchangeTimezoneName", "America/Toronto")
+        index = pd.to_datetime(result["timestamp"], unit="s", utc=True).tz_convert(exchange_tz)
 
-        return price_data if price_data else None
+        close = pd.Series(closes, index=index, dtype=float).dropna()
+        if close.empty:
+            return [], []
+
+        return close_to_columns(close)
 
     except Exception as e:
         print(f"  ❌ Error fetching data for {yahoo_ticker}: {e}")
         return None
 
 
-def batch_upsert_prices(price_records: List[Dict[str, Any]]) -> None:
+def is_payload_too_large(error: Exception) -> bool:
+    """
+    Check whether a Supabase error is an HTTP 413 / payload too large response.
     """
-    Upsert price records to Supabase in batches.
+    code = str(getattr(error, "code", "") or "")
+    message = str(getattr(error, "message", "") or error).lower()
+    return code == "413" or "too large" in message
 
-    Args:
-        price_records: List of dicts with 'company_id', 'date', 'close_price' keys
+
+async def upsert_price_batch(supabase: AsyncClient, batch: List[Dict[str, Any]]) -> None:
     """
-    if not price_records:
-        return
+    Upsert one batch of price records, halving it and retrying if Supabase
+    rejects the payload as too large.
+    """
+    try:
+        await supabase.table("stock_prices").upsert(
+            batch,
+            on_conflict="company_id,date"
+        ).execute()
 
-    total_records = len(price_records)
-    print(f"Upserting {total_records} price records in batches of {BATCH_SIZE}...")
+    except Exception as e:
+        if not is_payload_too_large(e) or len(batch) <= MIN_BATCH_SIZE:
+            raise
 
-    for i in range(0, total_records, BATCH_SIZE):
-        batch = price_records[i:i + BATCH_SIZE]
+        middle = len(batch) // 2
+        logger.warning("  ⚠️  Payload of %d records too large, splitting in half...", len(batch))
+        await upsert_price_batch(supabase, batch[:middle])
+        await upsert_price_batch(supabase, batch[middle:])
 
-        try:
-            supabase.table("stock_prices").upsert(
-                batch,
-                on_conflict="company_id,date"
-            ).execute()
 
-            print(f"  ✅ Upserted batch {i // BATCH_SIZE + 1} ({len(batch)} records)")
+async def batch_upsert_prices(supabase: AsyncClient, queue: asyncio.Queue) -> Tuple[int, int]:
+    """
+    Consume price records from a queue and upsert them to Supabase in batches.
 
-        except Exception as e:
-            print(f"  ❌ Error upserting batch {i // BATCH_SIZE + 1}: {e}")
-            continue
+    Producers put (company_id, dates, closes) tuples of parallel lists;
+    a None item marks the end of the stream. Records are buffered as
+    columns, de-duplicated on (company_id, date), and only turned into
+    row dicts one batch at a time.
+
+    Args:
+        supabase: Async Supabase client
+        queue: Queue of (company_id, dates, closes) tuples
+
+    Returns:
+        Tuple of (records upserted, batches that failed)
+    """
+    company_ids: List[int] = []
+    dates: List[str] = []
+    closes: List[float] = []
+    batch_number = 0
+    tasks = []
+    upsert_slots = asyncio.Semaphore(UPSERT_WORKERS)
+
+    async def upsert_numbered_batch(number: int, batch: List[Dict[str, Any]]) -> bool:
+        async with upsert_slots:
+            try:
+                await upsert_price_batch(supabase, batch)
+                logger.info("  ✅ Upserted batch %d (%d records)", number, len(batch))
+                return True
+            except Exception as e:
+                logger.error("  ❌ Error upserting batch %d: %s", number, e)
+                return False
+
+    while True:
+        item = await queue.get()
+
+        if item is not None:
+            company_id, item_dates, item_closes = item
+            company_ids.extend([company_id] * len(item_dates))
+            dates.extend(item_dates)
+            closes.extend(item_closes)
+
+        # Flush every full batch, plus the remainder once the stream ends
+        flush_count = len(dates) if item is None else len(dates) - len(dates) % BATCH_SIZE
+
+        if flush_count:
+            frame = pd.DataFrame({
+                "company_id": company_ids[:flush_count],
+                "date": dates[:flush_count],
+                "close_price": closes[:flush_count],
+            })
+
+            # One row per (company_id, date): the latest value wins. Postgres also
+            # rejects an upsert that would touch the same row twice.
+            frame = frame.drop_duplicates(subset=["company_id", "date"], keep="last")
+
+            for start in range(0, len(frame), BATCH_SIZE):
+                batch_number += 1
+                batch = frame.iloc[start:start + BATCH_SIZE].to_dict(orient="records")
+                tasks.append((len(batch), asyncio.create_task(upsert_numbered_batch(batch_number, batch))))
+
+            del company_ids[:flush_count], dates[:flush_count], closes[:flush_count]
+
+        if item is None:
+            break
+
+    results = [(size, await task) for size, task in tasks]
+    upserted = sum(size for size, ok in results if ok)
+    failed = sum(1 for _, ok in results if not ok)
+    return upserted, failed
 
 
 # ---------------------------------------------------------------------
 # Main Function
 # ---------------------------------------------------------------------
 
-def fetch_ytd_prices():
+async def fetch_ytd_prices():
     """
     Main function to fetch YTD stock prices and store in Supabase.
+
+    Price downloads run concurrently on one aiohttp session; each stock's
+    records are queued for upsert as soon as they arrive.
     """
     print(f"\n{'='*70}")
     print(f"Fetching YTD Stock Prices ({YTD_START_DATE} to {TODAY})")
     print(f"{'='*70}\n")
 
+    # The async client has to be created on the running event loop
+    supabase = await acreate_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
     # Get all stocks from database
-    stocks = get_all_stocks()
+    stocks = await get_all_stocks(supabase)
 
     if not stocks:
         print("No stocks found in database. Exiting.")
@@ -146,45 +396,70 @@ def fetch_ytd_prices():
     # Track statistics
     successful_count = 0
     failed_count = 0
+    no_new_data_count = 0
+    up_to_date_count = 0
     total_price_records = 0
-    all_price_records = []
 
-    print(f"\nFetching price data for {len(stocks)} stocks...\n")
+    # Only fetch the days after each company's latest stored price
+    latest_by_id = await get_latest_price_dates(supabase)
+    pending_stocks = []
 
-    for idx, stock in enumerate(stocks, 1):
-        company_id = stock["id"]
-        ticker = stock["ticker"]
+    for stock in stocks:
+        start_date = get_fetch_start_date(latest_by_id.get(stock["id"]))
 
-        print(f"[{idx}/{len(stocks)}] Fetching {ticker}...")
+        if start_date >= TODAY:
+            up_to_date_count += 1
+            continue
 
-        # Fetch price data from Yahoo Finance
-        price_data = fetch_price_data(ticker, YTD_START_DATE, TODAY)
+        pending_stocks.append((stock, start_date))
 
-        if price_data:
-            # Convert to database format
-            for price_point in price_data:
-                all_price_records.append({
-                    "company_id": company_id,
-                    "date": price_point["date"],
-                    "close_price": price_point["close"]
-                })
+    print(f"\nFetching price data for {len(pending_stocks)} stocks ({up_to_date_count} already up to date)...\n")
 
-            print(f"  ✅ Fetched {len(price_data)} price points for {ticker}")
-            successful_count += 1
-            total_price_records += len(price_data)
-        else:
-            print(f"  ❌ Failed to fetch data for {ticker}")
-            failed_count += 1
+    log_listener = start_log_listener()
+    queue: asyncio.Queue = asyncio.Queue()
+    uploader = asyncio.create_task(batch_upsert_prices(supabase, queue))
+    request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-        # Rate limiting: wait 0.5 seconds between requests
-        time.sleep(0.5)
+    async def fetch_and_enqueue(http: aiohttp.ClientSession, stock: Dict[str, Any], start_date: str):
+        async with request_slots:
+            price_data = await fetch_price_data(http, stock["ticker"], start_date, TODAY)
 
-    # Upsert all collected price records
-    print(f"\n{'='*70}")
-    print("Uploading price data to Supabase...")
-    print(f"{'='*70}\n")
+        if price_data and price_data[0]:
+            dates, closes = price_data
+            await queue.put((stock["id"], dates, closes))
+
+        return stock, price_data
+
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, limit_per_host=MAX_CONNECTIONS_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=YAHOO_TIMEOUT_SECONDS)
+
+    async with aiohttp.ClientSession(connector=connector, headers=YAHOO_HEADERS, timeout=timeout) as http:
+        fetches = [fetch_and_enqueue(http, stock, start_date) for stock, start_date in pending_stocks]
+
+        for idx, fetch in enumerate(asyncio.as_completed(fetches), 1):
+            stock, price_data = await fetch
+            ticker = stock["ticker"]
+
+            if price_data is None:
+                print(f"[{idx}/{len(fetches)}] ❌ Failed to fetch data for {ticker}")
+                failed_count += 1
+            elif price_data[0]:
+                price_point_count = len(price_data[0])
+                print(f"[{idx}/{len(fetches)}] ✅ Fetched {price_point_count} price points for {ticker}")
+                successful_count += 1
+                total_price_records += price_point_count
+            elif stock["id"] in latest_by_id:
+                # Nothing new since the last run (e.g. weekend or holiday)
+                print(f"[{idx}/{len(fetches)}] ⏭️  No new prices for {ticker}")
+                no_new_data_count += 1
+            else:
+                print(f"[{idx}/{len(fetches)}] ❌ No price data for {ticker}")
+                failed_count += 1
 
-    batch_upsert_prices(all_price_records)
+    # Signal the uploader that no more records are coming, then wait for it
+    await queue.put(None)
+    upserted_count, failed_batch_count = await uploader
+    log_listener.stop()
 
     # Print summary
     print(f"\n{'='*70}")
@@ -192,10 +467,14 @@ def fetch_ytd_prices():
     print(f"{'='*70}")
     print(f"Total stocks processed: {len(stocks)}")
     print(f"Successful: {successful_count}")
+    print(f"Already up to date: {up_to_date_count}")
+    print(f"No new prices: {no_new_data_count}")
     print(f"Failed: {failed_count}")
     print(f"Total price records collected: {total_price_records}")
+    print(f"Price records upserted: {upserted_count}")
+    print(f"Failed upsert batches: {failed_batch_count}")
     print(f"{'='*70}\n")
 
 
 if __name__ == "__main__":
-    fetch_ytd_prices()
+    asyncio.run(fetch_ytd_prices())
@@ -1,11 +1,15 @@
 import os
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
 from urllib.parse import urlparse
 
 import yfinance as yf
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from supabase_cache import invalidate_cache, load_cached, save_cached
+
 # ---------------------------------------------------------------------------
 # Load environment variables from .env
 # ---------------------------------------------------------------------------
@@ -33,6 +37,12 @@ TSX60_TICKERS = [
     "WPM.TO", "WSP.TO"
 ]
 
+MAX_WORKERS = 12  # Concurrent Yahoo Finance info requests
+
+# On-disk cache of get_info() results so reruns skip the Yahoo scrape
+INFO_CACHE_DIR = ".yfcache"
+INFO_CACHE_TTL_SECONDS = 24 * 60 * 60
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
@@ -51,6 +61,12 @@ def clean_ticker(yahoo_symbol: str) -> str:
     return yahoo_symbol
 
 
+# Yahoo symbol -> DB ticker, computed once so every lookup uses the same mapping
+DB_TICKER_BY_YAHOO: Mapping[str, str] = MappingProxyType(
+    {symbol: clean_ticker(symbol) for symbol in TSX60_TICKERS}
+)
+
+
 def build_logo_url(website: Optional[str]) -> Optional[str]:
     """
     Derive a logo URL from the company's website using Google's favicon service.
@@ -72,18 +88,25 @@ def build_logo_url(website: Optional[str]) -> Optional[str]:
 
 
 def fetch_stock_row(yahoo_symbol: str) -> Optional[Dict[str, Any]]:
-    print(f"Fetching {yahoo_symbol}...")
-    ticker_obj = yf.Ticker(yahoo_symbol)
+    info = load_cached(yahoo_symbol, INFO_CACHE_DIR, INFO_CACHE_TTL_SECONDS)
+
+    if info is not None:
+        print(f"Using cached info for {yahoo_symbol}")
+    else:
+        print(f"Fetching {yahoo_symbol}...")
+        ticker_obj = yf.Ticker(yahoo_symbol)
+
+        try:
+            info = ticker_obj.get_info()
+        except Exception as e:
+            print(f"  Error fetching info for {yahoo_symbol}: {e}")
+            return None
 
-    try:
-        info = ticker_obj.get_info()
-    except Exception as e:
-        print(f"  Error fetching info for {yahoo_symbol}: {e}")
-        return None
+        if not info:
+            print(f"  No info returned for {yahoo_symbol}")
+            return None
 
-    if not info:
-        print(f"  No info returned for {yahoo_symbol}")
-        return None
+        save_cached(yahoo_symbol, info, INFO_CACHE_DIR)
 
     current_price = info.get("currentPrice")
     prev_close = info.get("previousClose")
@@ -105,7 +128,7 @@ def fetch_stock_row(yahoo_symbol: str) -> Optional[Dict[str, Any]]:
 
     website = info.get("website")
     logo_url = build_logo_url(website)
-    ticker = clean_ticker(yahoo_symbol)
+    ticker = DB_TICKER_BY_YAHOO[yahoo_symbol]
 
     row: Dict[str, Any] = {
         "ticker": ticker,
@@ -131,12 +154,13 @@ def fetch_stock_row(yahoo_symbol: str) -> Optional[Dict[str, Any]]:
 # ---------------------------------------------------------------------------
 
 def seed_tsx60() -> None:
-    rows: List[Dict[str, Any]] = []
-
-    for symbol in TSX60_TICKERS:
-        row = fetch_stock_row(symbol)
-        if row is not None:
-            rows.append(row)
+    # get_info() calls are network-bound, so fetch them concurrently.
+    # executor.map keeps the rows in TSX60_TICKERS order.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        rows: List[Dict[str, Any]] = [
+            row for row in executor.map(fetch_stock_row, TSX60_TICKERS)
+            if row is not None
+        ]
 
     print(f"\nUpserting {len(rows)} rows into Supabase...")
 
@@ -145,6 +169,10 @@ def seed_tsx60() -> None:
     # - INSERT new rows when ticker does not exist
     resp = supabase.table("stocks").upsert(rows, on_conflict="ticker").execute()
 
+    # Scripts chained after the seed must see the new tickers, names and prices
+    invalidate_cache("stocks:all")
+    invalidate_cache("stock_info:")
+
     print("Supabase response:", resp)
 
 
@@ -1,6 +1,10 @@
 import os
+import random
+import threading
 import time
-from supabase import create_client, Client
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 import anthropic
 
@@ -14,79 +18,260 @@ SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 CLAUDE_API_KEY = os.environ["ANTHROPIC_API_KEY"]
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# One pooled HTTP client for Supabase, so the worker threads reuse warm
+# keep-alive connections instead of re-handshaking
+http_client = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=15, max_connections=30, keepalive_expiry=30),
+    timeout=30,
+)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_SERVICE_ROLE_KEY,
+    options=ClientOptions(httpx_client=http_client),
+)
 client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
 
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+MAX_TOKENS = 200
+BATCH_POLL_INTERVAL = 30  # Seconds between Message Batch status checks
+UPDATE_CHUNK_SIZE = 200  # Summaries written per set_stock_summaries call
+
+# Concurrency / rate limiting
+MAX_WORKERS = 8  # Stocks processed concurrently (Claude call + Supabase update)
+MAX_CONCURRENT_REQUESTS = 4  # Claude requests in flight at once; size to the org's RPM budget
+MAX_RETRIES = 5  # Attempts per summary when Claude is rate limited or overloaded
+RETRYABLE_STATUS_CODES = {429, 529}  # Rate limited / overloaded
+
+claude_semaphore = threading.Semaphore(MAX_CONCURRENT_REQUESTS)
+
 # ---------------------------------------------------------------------
 # AI Summarization Function
 # ---------------------------------------------------------------------
 
+# Static instructions shared by every request. Sent as a cacheable system
+# block so repeated requests can reuse the prefix instead of re-reading it.
+SYSTEM_PROMPT = """You are creating compelling investment pitches for companies in a Tinder-style investing app.
+
+For the company in each message, write a punchy, engaging 100-word summary that makes investors want to swipe right.
+
+Focus on:
+- What they do (in simple terms)
+- Why they matter (market position, competitive edge)
+- The opportunity (growth potential, sector trends)
+
+Style guidelines:
+- Start with a hook that captures attention
+- Use active, confident language
+- Make it scannable (2-3 short paragraphs or clear sentences)
+- Avoid jargon - write like you're explaining to a smart friend
+- End with momentum/forward-looking statement"""
+
+SYSTEM_BLOCKS = [
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+
+
+def build_message_params(text: str, name: str) -> dict:
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": MAX_TOKENS,
+        "system": SYSTEM_BLOCKS,
+        "messages": [{"role": "user", "content": f"Company: {name}\nRaw Description:\n{text}"}],
+    }
+
+
 def summarize_text(text: str, name: str) -> str:
-    prompt = f"""
-    You are creating a compelling investment pitch for "{name}" in a Tinder-style investing app.
-
-    Write a punchy, engaging 100-word summary that makes investors want to swipe right. 
-
-    Focus on:
-    - What they do (in simple terms)
-    - Why they matter (market position, competitive edge)
-    - The opportunity (growth potential, sector trends)
-
-    Style guidelines:
-    - Start with a hook that captures attention
-    - Use active, confident language
-    - Make it scannable (2-3 short paragraphs or clear sentences)
-    - Avoid jargon - write like you're explaining to a smart friend
-    - End with momentum/forward-looking statement
-
-    Company: {name}
-    Raw Description:
-    {text}
-    """
-    
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=200,
-        messages=[{"role": "user", "content": prompt}],
-    )
+    response = client.messages.create(**build_message_params(text, name))
     
     return response.content[0].text.strip()
 
+
+def retry_batch_call(fn, *args):
+    """
+    Call a Message Batches API read (status poll or results) with exponential
+    backoff on connection errors and 429/5xx responses, so a transient failure
+    doesn't abandon a batch that is already running.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            return fn(*args)
+        except (anthropic.APIConnectionError, anthropic.APIStatusError) as e:
+            status = getattr(e, "status_code", None)
+            retryable = status is None or status in RETRYABLE_STATUS_CODES or status >= 500
+            if not retryable or attempt == MAX_RETRIES - 1:
+                raise
+
+            delay = 2 ** attempt + random.random()
+            print(f"⏳ Batch API call failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+    raise RuntimeError("Exhausted retries calling the Message Batches API")
+
+
+def submit_summary_batch(stocks: list):
+    """
+    Submit one Message Batch summarizing every stock. Returns the batch.
+    """
+    batch = client.messages.batches.create(
+        requests=[
+            {
+                "custom_id": str(stock["id"]),
+                "params": build_message_params(stock["description"], stock["name"]),
+            }
+            for stock in stocks
+        ]
+    )
+    print(f"Submitted batch {batch.id} with {len(stocks)} requests.")
+
+    return batch
+
+
+def collect_batch_summaries(batch) -> dict:
+    """
+    Wait for a submitted batch to finish and read its results.
+    Returns {stock_id: summary} for the requests that succeeded.
+
+    Polls and result reads are retried. If polling still fails the batch is
+    cancelled before the error propagates, so it stops billing in the background.
+    """
+    try:
+        while batch.processing_status != "ended":
+            time.sleep(BATCH_POLL_INTERVAL)
+            batch = retry_batch_call(client.messages.batches.retrieve, batch.id)
+            counts = batch.request_counts
+            print(f"⏳ Batch {batch.id}: {counts.processing} processing, {counts.succeeded} succeeded, {counts.errored} errored")
+    except Exception:
+        try:
+            client.messages.batches.cancel(batch.id)
+            print(f"🛑 Cancelled batch {batch.id}")
+        except Exception as e:
+            print(f"❌ Error cancelling batch {batch.id}: {e}")
+        raise
+
+    # Read the whole stream inside the retry so a mid-stream failure re-reads it
+    results = retry_batch_call(lambda: list(client.messages.batches.results(batch.id)))
+
+    summaries = {}
+    for entry in results:
+        if entry.result.type == "succeeded":
+            summaries[int(entry.custom_id)] = entry.result.message.content[0].text.strip()
+        else:
+            print(f"❌ Batch request for stock {entry.custom_id} {entry.result.type}")
+
+    return summaries
+
+
+def summarize_text_with_retry(text: str, name: str) -> str:
+    """
+    Call summarize_text under the shared request semaphore, backing off
+    exponentially (or for the server's Retry-After) on 429/529 responses.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            with claude_semaphore:
+                return summarize_text(text, name)
+        except anthropic.APIStatusError as e:
+            if e.status_code not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES - 1:
+                raise
+
+            retry_after = e.response.headers.get("retry-after")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = 2 ** attempt + random.random()
+
+            print(f"⏳ Claude returned {e.status_code} for {name}, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+    raise RuntimeError(f"Exhausted retries summarizing {name}")
+
 # ---------------------------------------------------------------------
 # Main Function
 # ---------------------------------------------------------------------
 
+def summarize_stock(stock: dict):
+    """
+    Summarize one stock with a direct request. Returns the summary, or None on failure.
+    """
+    name = stock["name"]
+
+    print(f"Summarizing: {name}...")
+    try:
+        summary = summarize_text_with_retry(stock["description"], name)
+        print(f"✅ Summarized {name}")
+        return summary
+    except Exception as e:
+        print(f"❌ Error processing {name}: {e}")
+        return None
+
+
+def save_summaries(stocks: list, summaries: dict) -> None:
+    """
+    Write summaries back to the stocks table in chunked bulk updates via the
+    set_stock_summaries RPC (see add_stock_summaries_function.sql).
+    """
+    rows = [
+        {"id": stock["id"], "summary_ai": summaries[stock["id"]]}
+        for stock in stocks
+        if stock["id"] in summaries
+    ]
+
+    for i in range(0, len(rows), UPDATE_CHUNK_SIZE):
+        chunk = rows[i:i + UPDATE_CHUNK_SIZE]
+        try:
+            response = supabase.rpc("set_stock_summaries", {"summaries": chunk}).execute()
+            print(f"✅ Saved {response.data or 0} summaries")
+        except Exception as e:
+            print(f"❌ Error saving {len(chunk)} summaries: {e}")
+
+
 def summarize_missing_stocks():
     print("Fetching stocks with missing AI summaries...")
     
-    data = (
+    # Stocks without a description have nothing to summarize, so filter them out in SQL
+    pending = (
         supabase.table("stocks")
-        .select("id, name, description")
+        .select("id, ticker, name, description")
         .is_("summary_ai", "null")
+        .not_.is_("description", "null")
+        .neq("description", "")
         .execute()
     ).data
 
-    print(f"Found {len(data)} stocks to summarize.")
-
-    for stock in data:
-        desc = stock["description"]
-        name = stock["name"]
+    print(f"Found {len(pending)} stocks to summarize.")
 
-        if not desc:
-            print(f"Skipping {name} — no description found.")
-            continue
+    if not pending:
+        print("✨ Nothing to summarize!")
+        return
 
-        print(f"Summarizing: {name}...")
+    try:
+        batch = submit_summary_batch(pending)
+    except Exception as e:
+        # Nothing was submitted, so every stock falls back to direct requests
+        print(f"❌ Error submitting summary batch: {e}")
+        summaries = {}
+    else:
         try:
-            summary = summarize_text(desc, name)
-            supabase.table("stocks").update({"summary_ai": summary}).eq("id", stock["id"]).execute()
-            print(f"✅ Saved summary for {name}")
+            summaries = collect_batch_summaries(batch)
         except Exception as e:
-            print(f"❌ Error processing {name}: {e}")
-            continue
+            # The batch may already have run (and been billed); summarizing the
+            # same stocks again directly would pay twice, so leave them for the next run
+            print(f"❌ Error reading summary batch {batch.id}: {e}")
+            print("Skipping direct-request fallback; rerun to summarize the remaining stocks.")
+            return
+
+    # Anything the batch could not summarize falls back to direct requests
+    failed = [stock for stock in pending if stock["id"] not in summaries]
+
+    if failed:
+        print(f"Retrying {len(failed)} stocks with direct requests...")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for stock, summary in zip(failed, executor.map(summarize_stock, failed)):
+            if summary is not None:
+                summaries[stock["id"]] = summary
 
-        # Rate limit: wait 1 second between API calls to avoid hitting rate limits
-        time.sleep(1)
+    save_summaries(pending, summaries)
 
     print("✨ Done updating all summaries!")
 
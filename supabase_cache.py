@@ -0,0 +1,143 @@
+"""
+Short-lived disk cache for Supabase reads shared across scripts.
+
+update_stock_metrics.py, visualize_all_stocks.py and upload_charts_to_supabase.py
+all start by reading the stocks table. When they are run back to back, the
+cache answers the repeated reads instead of PostgREST.
+
+seed_tsx60.py also keeps its yfinance get_info() results here, in its own
+directory with a 24-hour TTL.
+
+Also holds the range()-paging helpers every script uses for reads that can
+outgrow PostgREST's max-rows limit.
+
+Usage:
+    stocks = cached_rows("stocks:all", lambda: list(paged_select(lambda: supabase.table("stocks").select("id, ticker").order("id"))))
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+# ---------------------------------------------------------------------
+# Setup
+# ---------------------------------------------------------------------
+
+CACHE_DIR = ".supabase_cache"
+CACHE_TTL_SECONDS = 60
+PAGE_SIZE = 1000  # Rows per page; PostgREST caps responses at 1000 by default
+
+# ---------------------------------------------------------------------
+# Helper Functions
+# ---------------------------------------------------------------------
+
+def cache_path(key: str, cache_dir: str = CACHE_DIR) -> str:
+    safe_key = "".join(c if c.isalnum() or c in "-_" else "_" for c in key)
+    return os.path.join(cache_dir, f"{safe_key}.json")
+
+
+def load_cached(key: str, cache_dir: str = CACHE_DIR, ttl_seconds: float = CACHE_TTL_SECONDS) -> Any:
+    """
+    Return the cached value for key if it is younger than ttl_seconds,
+    otherwise None.
+    """
+    path = cache_path(key, cache_dir)
+
+    try:
+        if time.time() - os.path.getmtime(path) > ttl_seconds:
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached(key: str, value: Any, cache_dir: str = CACHE_DIR) -> None:
+    """
+    Write a value to the cache. Failures only cost a refetch next time.
+    """
+    path = cache_path(key, cache_dir)
+    tmp_path = f"{path}.tmp"
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, default=str)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"  Could not cache {key}: {e}")
+
+
+def cached_rows(key: str, fetch: Callable[[], Any]) -> Any:
+    """
+    Return the cached value for key, calling fetch() and caching its result
+    on a miss. Empty results are not cached.
+    """
+    value = load_cached(key)
+
+    if value is not None:
+        return value
+
+    value = fetch()
+
+    if value:
+        save_cached(key, value)
+
+    return value
+
+
+def invalidate_cache(prefix: str = "") -> None:
+    """
+    Drop cached entries whose key starts with prefix (all of them by default).
+    Call after writing to the cached tables.
+    """
+    if not prefix:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        return
+
+    file_prefix = os.path.basename(cache_path(prefix))[:-len(".json")]
+
+    try:
+        for file_name in os.listdir(CACHE_DIR):
+            if file_name.startswith(file_prefix):
+                os.remove(os.path.join(CACHE_DIR, file_name))
+    except OSError:
+        pass
+
+
+def paged_select(build_query: Callable[[], Any], page_size: int = PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Yield every row of a select, one PostgREST range page at a time.
+    A bare select() silently stops at the server's max-rows limit.
+
+    build_query must return a fresh, ordered query builder on each call
+    (range() adds to the builder's params, so one builder cannot be reused).
+    """
+    start = 0
+
+    while True:
+        response = build_query().range(start, start + page_size - 1).execute()
+        yield from response.data
+
+        if len(response.data) < page_size:
+            return
+        start += page_size
+
+
+async def apaged_select(build_query: Callable[[], Any], page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """
+    Async paged_select for the async Supabase client. Returns all rows.
+    """
+    rows = []
+    start = 0
+
+    while True:
+        response = await build_query().range(start, start + page_size - 1).execute()
+        rows.extend(response.data)
+
+        if len(response.data) < page_size:
+            return rows
+        start += page_size
@@ -13,8 +13,7 @@ Run this after executing create_user_tracking_tables.sql in Supabase.
 """
 
 import os
-import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Tuple
 from datetime import datetime
 
 from supabase import create_client, Client
@@ -100,54 +99,64 @@ def get_or_create_test_user() -> str:
 
 
 def get_random_stocks(limit: int = 10) -> List[Dict[str, Any]]:
-    """Get random stocks from database."""
-    response = supabase.table("stocks").select("id, ticker, name").limit(60).execute()
+    """Get random stocks from database (sampled in Postgres)."""
+    response = supabase.rpc("get_random_stocks", {"n": limit}).execute()
 
     if not response.data:
         print("❌ No stocks found in database")
         return []
 
-    # Randomly sample stocks
-    all_stocks = response.data
-    sample_size = min(limit, len(all_stocks))
-    return random.sample(all_stocks, sample_size)
+    return response.data
 
 
-def record_swipe(user_id: str, company_id: int, direction: str) -> bool:
-    """Record a swipe action."""
+def record_swipes(user_id: str, swipes: List[Tuple[int, str]]) -> Set[int]:
+    """
+    Record several swipe actions in one request.
+
+    Duplicate swipes are skipped by the unique_user_company_swipe constraint.
+    Returns the company IDs that were newly recorded.
+    """
+    rows = [
+        {"user_id": user_id, "company_id": company_id, "swipe_direction": direction}
+        for company_id, direction in swipes
+    ]
+
     try:
-        response = supabase.table("user_swipes").insert({
-            "user_id": user_id,
-            "company_id": company_id,
-            "swipe_direction": direction
-        }).execute()
+        response = supabase.table("user_swipes").upsert(
+            rows,
+            on_conflict="user_id,company_id",
+            ignore_duplicates=True
+        ).execute()
 
-        return True
+        return {row["company_id"] for row in response.data or []}
     except Exception as e:
-        # Duplicate swipe is okay - unique constraint will prevent it
-        if "unique_user_company_swipe" in str(e):
-            print(f"  ⚠️  Already swiped on this stock")
-            return False
-        print(f"  ❌ Error recording swipe: {e}")
-        return False
+        print(f"  ❌ Error recording swipes: {e}")
+        return set()
+
 
+def add_to_watchlist(user_id: str, items: List[Tuple[int, str]]) -> Set[int]:
+    """
+    Add several stocks (company_id, notes) to user's watchlist in one request.
+
+    Stocks already in the watchlist are skipped by the unique_user_company_watchlist
+    constraint. Returns the company IDs that were newly added.
+    """
+    rows = [
+        {"user_id": user_id, "company_id": company_id, "notes": notes}
+        for company_id, notes in items
+    ]
 
-def add_to_watchlist(user_id: str, company_id: int, notes: str = None) -> bool:
-    """Add stock to user's watchlist."""
     try:
-        response = supabase.table("user_watchlist").insert({
-            "user_id": user_id,
-            "company_id": company_id,
-            "notes": notes
-        }).execute()
+        response = supabase.table("user_watchlist").upsert(
+            rows,
+            on_conflict="user_id,company_id",
+            ignore_duplicates=True
+        ).execute()
 
-        return True
+        return {row["company_id"] for row in response.data or []}
     except Exception as e:
-        if "unique_user_company_watchlist" in str(e):
-            print(f"  ⚠️  Already in watchlist")
-            return False
         print(f"  ❌ Error adding to watchlist: {e}")
-        return False
+        return set()
 
 
 def get_user_swipes(user_id: str) -> List[Dict[str, Any]]:
@@ -231,16 +240,21 @@ def run_tests():
     left_swipes = stocks[:5]  # First 5 = pass (left)
     right_swipes = stocks[5:]  # Last 5 = like (right)
 
+    recorded = record_swipes(
+        user_id,
+        [(stock["id"], "left") for stock in left_swipes]
+        + [(stock["id"], "right") for stock in right_swipes]
+    )
+
+    # ⚠️ = already swiped on this stock
     print("\n  Left swipes (PASS):")
     for stock in left_swipes:
-        success = record_swipe(user_id, stock["id"], "left")
-        icon = "✅" if success else "⚠️"
+        icon = "✅" if stock["id"] in recorded else "⚠️"
         print(f"    {icon} {stock['ticker']} - {stock['name']}")
 
     print("\n  Right swipes (LIKE):")
     for stock in right_swipes:
-        success = record_swipe(user_id, stock["id"], "right")
-        icon = "✅" if success else "⚠️"
+        icon = "✅" if stock["id"] in recorded else "⚠️"
         print(f"    {icon} {stock['ticker']} - {stock['name']}")
 
     print()
@@ -250,10 +264,17 @@ def run_tests():
     # ---------------------------------------------------------------------
     print("⭐ Step 3: Adding liked stocks to watchlist...")
 
+    added = add_to_watchlist(
+        user_id,
+        [
+            (stock["id"], f"Interested in {stock['ticker']} - potential investment")
+            for stock in right_swipes
+        ]
+    )
+
+    # ⚠️ = already in watchlist
     for stock in right_swipes:
-        notes = f"Interested in {stock['ticker']} - potential investment"
-        success = add_to_watchlist(user_id, stock["id"], notes)
-        icon = "✅" if success else "⚠️"
+        icon = "✅" if stock["id"] in added else "⚠️"
         print(f"  {icon} Added {stock['ticker']} to watchlist")
 
     print()
@@ -1,7 +1,8 @@
 """
 Calculate and update YTD performance metrics for stocks.
 
-Reads price data from stock_prices table and updates the stocks table with:
+Recomputes the metrics inside Postgres (see refresh_stock_ytd in
+add_stock_metrics_columns.sql) and updates the stocks table with:
 - ytd_return: Year-to-date return percentage
 - current_price: Most recent closing price
 - first_price_2025: First closing price in 2025
@@ -11,16 +12,21 @@ Requirements:
 - stocks table must have columns: id, ticker, ytd_return, current_price,
   first_price_2025, price_updated_at
 - stock_prices table must have: company_id, date, close_price
+- stock_prices.updated_at column and its trigger (create_stock_prices_table.sql)
+- stock_price_endpoints(), refresh_stock_ytd(), stocks_needing_ytd_refresh(),
+  count_stocks_without_ytd_prices() and stock_ytd_average() functions must exist
 """
 
+import asyncio
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
-from decimal import Decimal
+from typing import List, Dict, Any, Set, Tuple
 
-from supabase import create_client, Client
+import httpx
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
 from dotenv import load_dotenv
 
+from supabase_cache import invalidate_cache, load_cached
+
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
@@ -30,205 +36,239 @@ load_dotenv()
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+REFRESH_BATCH_SIZE = 100  # Stocks per refresh_stock_ytd call and per report lookup
+REFRESH_WORKERS = 4  # refresh_stock_ytd calls in flight at once
+REPORT_RANK_SIZE = 5  # Top and bottom performers shown in the report
 
 # ---------------------------------------------------------------------
 # Helper Functions
 # ---------------------------------------------------------------------
 
-def get_all_stocks() -> List[Dict[str, Any]]:
+async def get_stale_stock_ids(supabase: AsyncClient) -> Set[int]:
+    """
+    Fetch the IDs of stocks with prices stored or corrected since their metrics
+    were last refreshed (or never refreshed), via the stocks_needing_ytd_refresh RPC.
+    """
+    response = await supabase.rpc("stocks_needing_ytd_refresh").execute()
+    return set(response.data or [])
+
+
+async def count_stocks(supabase: AsyncClient) -> int:
     """
-    Fetch all stocks from Supabase stocks table.
-    Returns list of dicts with 'id' and 'ticker' keys.
+    Count the stocks table, from the shared stocks cache when it is warm,
+    otherwise with a count-only request that transfers no rows.
     """
-    print("Fetching stocks from Supabase...")
+    stocks = load_cached("stocks:all")
 
-    response = supabase.table("stocks").select("id, ticker").execute()
-    stocks = response.data
+    if stocks is not None:
+        return len(stocks)
 
-    print(f"✅ Found {len(stocks)} stocks in database\n")
-    return stocks
+    response = await supabase.table("stocks").select("id", count="exact", head=True).execute()
+    return response.count or 0
 
 
-def get_price_metrics(company_id: int) -> Optional[Tuple[Decimal, Decimal, str, str]]:
+async def produce_id_batches(queue: asyncio.Queue, stale_ids: Set[int]) -> int:
     """
-    Get first and latest price data for a company from stock_prices table.
+    Queue the stale IDs for refresh in batches of REFRESH_BATCH_SIZE.
 
     Args:
-        company_id: The company ID to query
+        queue: Queue that receives lists of company IDs
+        stale_ids: IDs of stocks that need a refresh
 
     Returns:
-        Tuple of (first_price, latest_price, first_date, latest_date) or None if no data
+        Number of stocks queued
     """
-    try:
-        # Get first price in 2025 (earliest date)
-        first_response = (
-            supabase.table("stock_prices")
-            .select("close_price, date")
-            .eq("company_id", company_id)
-            .gte("date", "2025-01-01")
-            .order("date", desc=False)
-            .limit(1)
-            .execute()
-        )
-
-        # Get most recent price
-        latest_response = (
-            supabase.table("stock_prices")
-            .select("close_price, date")
-            .eq("company_id", company_id)
-            .order("date", desc=True)
-            .limit(1)
-            .execute()
-        )
+    company_ids = sorted(stale_ids)
 
-        if not first_response.data or not latest_response.data:
-            return None
+    for start in range(0, len(company_ids), REFRESH_BATCH_SIZE):
+        await queue.put(company_ids[start:start + REFRESH_BATCH_SIZE])
 
-        first_price = Decimal(str(first_response.data[0]["close_price"]))
-        first_date = first_response.data[0]["date"]
-        latest_price = Decimal(str(latest_response.data[0]["close_price"]))
-        latest_date = latest_response.data[0]["date"]
+    return len(company_ids)
 
-        return (first_price, latest_price, first_date, latest_date)
 
-    except Exception as e:
-        print(f"  ❌ Error querying price data: {e}")
-        return None
-
-
-def calculate_ytd_return(first_price: Decimal, current_price: Decimal) -> Decimal:
+async def refresh_worker(supabase: AsyncClient, queue: asyncio.Queue) -> Tuple[Set[int], int, int]:
     """
-    Calculate YTD return percentage.
+    Recompute YTD metrics for each queued batch of IDs until a None arrives.
 
-    Formula: ((current - first) / first) * 100
+    Each batch is one set-oriented UPDATE in Postgres (refresh_stock_ytd),
+    which reads only each company's first and latest 2025 price.
 
     Args:
-        first_price: First closing price in 2025
-        current_price: Most recent closing price
+        supabase: Async Supabase client
+        queue: Queue of company ID lists; None ends the worker
 
     Returns:
-        YTD return as a percentage (Decimal)
+        Tuple of (IDs of stocks updated, batches that failed, stocks in failed batches)
     """
-    if first_price == 0:
-        return Decimal("0")
+    updated_ids: Set[int] = set()
+    failed_batches = 0
+    failed_stocks = 0
 
-    return ((current_price - first_price) / first_price) * Decimal("100")
+    while True:
+        company_ids = await queue.get()
 
+        if company_ids is None:
+            return updated_ids, failed_batches, failed_stocks
 
-def batch_update_stocks(update_records: List[Dict[str, Any]]) -> None:
-    """
-    Update stock metrics in batches.
+        try:
+            response = await supabase.rpc("refresh_stock_ytd", {"company_ids": company_ids}).execute()
+            updated_ids.update(response.data or [])
+            print(f"  ✅ Refreshed batch of {len(company_ids)} stocks")
+        except Exception as e:
+            print(f"  ❌ Error refreshing batch of {len(company_ids)} stocks: {e}")
+            failed_batches += 1
+            failed_stocks += len(company_ids)
 
-    Args:
-        update_records: List of dicts with stock updates
-    """
-    if not update_records:
-        return
 
-    print(f"\nUpdating {len(update_records)} stocks in database...")
+async def get_refreshed_stocks(supabase: AsyncClient, company_ids: Set[int]) -> List[Dict[str, Any]]:
+    """
+    Fetch the new metrics of the stocks refreshed this run, best performers first.
+    """
+    ids = sorted(company_ids)
+    records = []
+
+    for start in range(0, len(ids), REFRESH_BATCH_SIZE):
+        response = await (
+            supabase.table("stocks")
+            .select("id, ticker, ytd_return, current_price")
+            .in_("id", ids[start:start + REFRESH_BATCH_SIZE])
+            .not_.is_("ytd_return", "null")
+            .execute()
+        )
+        records.extend(response.data)
 
-    # Supabase upsert requires individual updates when using id as key
-    # So we'll do them one by one but efficiently
-    for record in update_records:
-        try:
-            supabase.table("stocks").update({
-                "ytd_return": float(record["ytd_return"]),
-                "current_price": float(record["current_price"]),
-                "first_price_2025": float(record["first_price_2025"]),
-                "price_updated_at": record["price_updated_at"]
-            }).eq("id", record["id"]).execute()
+    records.sort(key=lambda r: float(r["ytd_return"]), reverse=True)
+    return records
 
-        except Exception as e:
-            print(f"  ❌ Error updating {record.get('ticker', 'unknown')}: {e}")
-            continue
 
-    print("✅ Database updated successfully\n")
+async def get_ranked_stocks(supabase: AsyncClient, best: bool) -> List[Dict[str, Any]]:
+    """
+    Fetch the REPORT_RANK_SIZE best (or worst) performers across all stocks.
+    """
+    response = await (
+        supabase.table("stocks")
+        .select("id, ticker, ytd_return, current_price")
+        .not_.is_("ytd_return", "null")
+        .order("ytd_return", desc=best)
+        .order("id")
+        .limit(REPORT_RANK_SIZE)
+        .execute()
+    )
+    return response.data
 
 
 # ---------------------------------------------------------------------
 # Main Function
 # ---------------------------------------------------------------------
 
-def update_stock_metrics():
+async def update_stock_metrics():
     """
     Main function to calculate and update YTD metrics for all stocks.
+
+    Only stocks with prices stored or corrected since their last refresh are
+    touched, so a run with nothing new costs a handful of requests however
+    large the table.
     """
     print(f"\n{'='*70}")
     print("Calculating YTD Performance Metrics")
     print(f"{'='*70}\n")
 
-    # Get all stocks
-    stocks = get_all_stocks()
+    # Closed on every exit path, including the report's early returns
+    async with httpx.AsyncClient(
+        limits=httpx.Limits(max_keepalive_connections=15, max_connections=30, keepalive_expiry=30),
+        timeout=30,
+    ) as http_client:
+        supabase = await acreate_client(
+            SUPABASE_URL,
+            SUPABASE_SERVICE_ROLE_KEY,
+            options=AsyncClientOptions(httpx_client=http_client),
+        )
+        await refresh_and_report(supabase)
 
-    if not stocks:
-        print("No stocks found in database. Exiting.")
-        return
 
-    # Track statistics
-    update_records = []
-    skipped_count = 0
-    current_timestamp = datetime.utcnow().isoformat()
+async def refresh_and_report(supabase: AsyncClient) -> None:
+    """
+    Refresh the stale stocks' metrics and print the run report.
+    """
+    try:
+        # Only stocks with new or corrected prices since their last refresh need work
+        stale_ids, total_stocks, no_price_response = await asyncio.gather(
+            get_stale_stock_ids(supabase),
+            count_stocks(supabase),
+            supabase.rpc("count_stocks_without_ytd_prices").execute(),
+        )
+    except Exception as e:
+        print(f"❌ Error fetching stocks: {e}")
+        return
 
-    print("Processing stocks...\n")
+    if total_stocks == 0:
+        print("No stocks found in database. Exiting.")
+        return
 
-    for idx, stock in enumerate(stocks, 1):
-        company_id = stock["id"]
-        ticker = stock["ticker"]
+    updated_ids: Set[int] = set()
+    failed_count = 0
 
-        print(f"[{idx}/{len(stocks)}] {ticker}...", end=" ")
+    if stale_ids:
+        print(f"Refreshing metrics for {len(stale_ids)} stocks in database...")
 
-        # Get price data
-        price_data = get_price_metrics(company_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=REFRESH_WORKERS * 2)
+        workers = [asyncio.create_task(refresh_worker(supabase, queue)) for _ in range(REFRESH_WORKERS)]
 
-        if price_data is None:
-            print("⚠️  No price data available (skipped)")
-            skipped_count += 1
-            continue
+        await produce_id_batches(queue, stale_ids)
 
-        first_price, latest_price, first_date, latest_date = price_data
+        for _ in workers:
+            await queue.put(None)
 
-        # Calculate YTD return
-        ytd_return = calculate_ytd_return(first_price, latest_price)
+        results = await asyncio.gather(*workers)
+        updated_ids = set().union(*(ids for ids, _, _ in results))
+        failed_batches = sum(batches for _, batches, _ in results)
+        failed_count = sum(stocks for _, _, stocks in results)
 
-        # Store update record
-        update_records.append({
-            "id": company_id,
-            "ticker": ticker,
-            "ytd_return": ytd_return,
-            "current_price": latest_price,
-            "first_price_2025": first_price,
-            "price_updated_at": current_timestamp
-        })
+        # Cached stock info now carries stale metrics
+        invalidate_cache("stock_info:")
 
-        # Print metrics
-        ytd_str = f"{ytd_return:+.2f}%"
-        price_str = f"${latest_price:.2f}"
-        print(f"✅ YTD: {ytd_str:>8} | Price: {price_str:>10} ({first_date} → {latest_date})")
+        if failed_batches:
+            print(f"⚠️  {failed_batches} refresh batches failed")
 
-    # Update database
-    batch_update_stocks(update_records)
+        print(f"✅ Database updated successfully ({len(updated_ids)} stocks)\n")
+    else:
+        print("✅ All stock metrics are up to date\n")
+
+    updated_count = len(updated_ids)
+    # Stocks with no 2025 prices are never stale, so count them apart
+    no_price_count = no_price_response.data or 0
+    up_to_date_count = total_stocks - len(stale_ids) - no_price_count
+
+    refreshed_records, top_5, bottom_5, avg_response = await asyncio.gather(
+        get_refreshed_stocks(supabase, updated_ids),
+        get_ranked_stocks(supabase, best=True),
+        get_ranked_stocks(supabase, best=False),
+        supabase.rpc("stock_ytd_average").execute(),
+    )
+
+    # Print metrics for the stocks refreshed this run
+    for idx, record in enumerate(refreshed_records, 1):
+        ytd_str = f"{float(record['ytd_return']):+.2f}%"
+        price_str = f"${float(record['current_price']):.2f}"
+        print(f"[{idx}/{len(refreshed_records)}] {record['ticker']}... ✅ YTD: {ytd_str:>8} | Price: {price_str:>10}")
 
     # Print summary
-    print(f"{'='*70}")
+    print(f"\n{'='*70}")
     print("Summary Statistics")
     print(f"{'='*70}\n")
 
-    if update_records:
-        # Calculate statistics
-        total_updated = len(update_records)
-        ytd_returns = [float(r["ytd_return"]) for r in update_records]
-        avg_ytd = sum(ytd_returns) / len(ytd_returns)
-
-        # Sort by YTD return
-        sorted_records = sorted(update_records, key=lambda x: float(x["ytd_return"]), reverse=True)
-        top_5 = sorted_records[:5]
-        bottom_5 = sorted_records[-5:]
+    if top_5:
+        # Statistics cover current standings across all stocks, not just
+        # this run's refreshes; bottom 5 is listed best first
+        avg_ytd = float(avg_response.data)
+        bottom_5 = bottom_5[::-1]
 
-        print(f"Total companies processed: {len(stocks)}")
-        print(f"Successfully updated: {total_updated}")
-        print(f"Skipped (no data): {skipped_count}")
-        print(f"Average YTD return: {avg_ytd:+.2f}%\n")
+        print(f"Total companies processed: {total_stocks}")
+        print(f"Successfully updated: {updated_count}")
+        print(f"Up to date (no new prices): {up_to_date_count}")
+        print(f"Failed (refresh errors): {failed_count}")
+        print(f"No 2025 prices: {no_price_count}")
+        print(f"Average YTD return (all stocks): {avg_ytd:+.2f}%\n")
 
         print("Top 5 Performers:")
         print(f"{'Rank':<6} {'Ticker':<10} {'YTD Return':<12} {'Current Price':<15}")
@@ -247,11 +287,13 @@ def update_stock_metrics():
             print(f"{i:<6} {record['ticker']:<10} {ytd:+.2f}%{' ':<8} ${price:.2f}")
 
     else:
-        print("No stocks were updated.")
-        print(f"Skipped (no data): {skipped_count}")
+        print("No stocks have YTD metrics yet.")
+        print(f"Up to date (no new prices): {up_to_date_count}")
+        print(f"Failed (refresh errors): {failed_count}")
+        print(f"No 2025 prices: {no_price_count}")
 
     print(f"\n{'='*70}\n")
 
 
 if __name__ == "__main__":
-    update_stock_metrics()
+    asyncio.run(update_stock_metrics())
@@ -8,12 +8,17 @@ This script:
 - Shows progress and summary
 """
 
+import hashlib
 import os
-from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 
+from supabase_cache import cached_rows, paged_select
+
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
@@ -23,11 +28,25 @@ load_dotenv()
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# One pooled HTTP client shared by PostgREST and Storage, so repeated
+# requests reuse warm keep-alive connections instead of re-handshaking
+http_client = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=15, max_connections=30, keepalive_expiry=30),
+    timeout=30,
+)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_SERVICE_ROLE_KEY,
+    options=ClientOptions(httpx_client=http_client),
+)
 
 # Constants
 CHART_DIR = "charts"
 BUCKET_NAME = "stock-charts"
+PUBLIC_URL_PREFIX = f"{SUPABASE_URL}/storage/v1/object/public/{BUCKET_NAME}"  # Same string get_public_url() builds
+MAX_WORKERS = 16  # Concurrent chart uploads
+UPDATE_CHUNK_SIZE = 500  # Chart URLs written per set_chart_urls call
+HASH_CHUNK_SIZE = 64 * 1024  # Bytes read at a time when hashing a chart
 
 # ---------------------------------------------------------------------
 # Helper Functions
@@ -35,11 +54,13 @@ BUCKET_NAME = "stock-charts"
 
 def get_all_stocks() -> List[dict]:
     """
-    Fetch all stocks from Supabase.
-    Returns list of dicts with id and ticker.
+    Fetch all stocks from Supabase (cached briefly across scripts).
+    Returns list of dicts with id, ticker, name.
     """
-    response = supabase.table("stocks").select("id, ticker").execute()
-    return response.data
+    return cached_rows(
+        "stocks:all",
+        lambda: list(paged_select(lambda: supabase.table("stocks").select("id, ticker, name").order("id")))
+    )
 
 
 def ensure_bucket_exists():
@@ -66,68 +87,104 @@ def ensure_bucket_exists():
         print("Continuing with upload attempts...")
 
 
-def upload_chart_to_storage(ticker: str) -> Optional[str]:
+def get_chart_hashes() -> Dict[int, str]:
+    """
+    Fetch the hash of each stock's last uploaded chart.
+    Read fresh rather than cached, since uploads change it.
+    """
+    rows = paged_select(
+        lambda: supabase.table("stocks")
+        .select("id, chart_image_hash")
+        .not_.is_("chart_image_hash", "null")
+        .order("id")
+    )
+    return {row["id"]: row["chart_image_hash"] for row in rows}
+
+
+def hash_file(f: BinaryIO) -> str:
+    """
+    SHA-256 hex digest of an open binary file, read in HASH_CHUNK_SIZE chunks.
+    """
+    digest = hashlib.sha256()
+
+    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def upload_chart_to_storage(ticker: str, previous_hash: Optional[str] = None) -> Tuple[str, Optional[str], Optional[str]]:
     """
-    Upload a chart image to Supabase Storage.
+    Upload a chart image to Supabase Storage unless it is unchanged.
 
     Args:
         ticker: Stock ticker symbol
+        previous_hash: SHA-256 of the chart uploaded last time, if any
 
     Returns:
-        Public URL of uploaded image, or None if upload fails
+        Tuple of (status, public_url, file_hash). status is "uploaded",
+        "unchanged" (matches previous_hash), "missing" or "failed".
     """
     # Check if local file exists
     local_path = os.path.join(CHART_DIR, f"{ticker}_ytd_chart.png")
 
     if not os.path.exists(local_path):
-        return None
-
-    # Read file
-    with open(local_path, "rb") as f:
-        file_data = f.read()
+        return ("missing", None, None)
 
     # Storage path in bucket
     storage_path = f"{ticker}_ytd_chart.png"
 
     try:
-        # Upload to Supabase Storage (upsert to overwrite if exists)
-        supabase.storage.from_(BUCKET_NAME).upload(
-            storage_path,
-            file_data,
-            file_options={"content-type": "image/png", "upsert": "true"}
-        )
+        # Stream the file: hash it chunk by chunk, then hand the open file
+        # to the upload so httpx sends it without buffering it in memory
+        with open(local_path, "rb") as f:
+            file_hash = hash_file(f)
+
+            # Identical bytes are already in the bucket
+            if file_hash == previous_hash:
+                return ("unchanged", None, file_hash)
+
+            f.seek(0)
+
+            # Upload to Supabase Storage (upsert to overwrite if exists)
+            supabase.storage.from_(BUCKET_NAME).upload(
+                storage_path,
+                f,
+                file_options={"content-type": "image/png", "upsert": "true"}
+            )
 
-        # Get public URL
-        public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(storage_path)
+        # Public URL is deterministic, so build it locally instead of asking the SDK
+        public_url = f"{PUBLIC_URL_PREFIX}/{storage_path}"
 
-        return public_url
+        return ("uploaded", public_url, file_hash)
 
     except Exception as e:
         print(f"  ❌ Upload error: {e}")
-        return None
+        return ("failed", None, None)
 
 
-def update_stock_chart_url(stock_id: int, chart_url: str) -> bool:
+def save_chart_urls(rows: List[dict]) -> int:
     """
-    Update stocks table with chart image URL.
+    Write chart image URLs to the stocks table in chunked bulk updates
+    via the set_chart_urls RPC (see add_chart_image_url_column.sql).
 
     Args:
-        stock_id: Stock ID
-        chart_url: Public URL of chart image
+        rows: Dicts with id, chart_image_url and chart_image_hash
 
     Returns:
-        True if update successful, False otherwise
+        Number of stocks whose URL was saved
     """
-    try:
-        supabase.table("stocks").update(
-            {"chart_image_url": chart_url}
-        ).eq("id", stock_id).execute()
+    saved_count = 0
 
-        return True
+    for i in range(0, len(rows), UPDATE_CHUNK_SIZE):
+        chunk = rows[i:i + UPDATE_CHUNK_SIZE]
+        try:
+            response = supabase.rpc("set_chart_urls", {"charts": chunk}).execute()
+            saved_count += response.data or 0
+        except Exception as e:
+            print(f"  ❌ Database update error for {len(chunk)} stocks: {e}")
 
-    except Exception as e:
-        print(f"  ❌ Database update error: {e}")
-        return False
+    return saved_count
 
 
 # ---------------------------------------------------------------------
@@ -155,36 +212,59 @@ def upload_all_charts():
         return
 
     print(f"Found {total_stocks} stocks in database.\n")
+
+    chart_hashes = get_chart_hashes()
+
     print("Uploading charts...\n")
 
     # Track statistics
-    successful_count = 0
     skipped_count = 0
-    failed_count = 0
+    unchanged_count = 0
+    upload_failed_count = 0
+    url_rows = []
 
-    for idx, stock in enumerate(stocks, 1):
-        stock_id = stock["id"]
-        ticker = stock["ticker"]
+    # Uploads are independent and network-bound, so run them concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(upload_chart_to_storage, stock["ticker"], chart_hashes.get(stock["id"])): stock
+            for stock in stocks
+        }
 
-        print(f"[{idx}/{total_stocks}] {ticker}...", end=" ")
+        for idx, future in enumerate(as_completed(futures), 1):
+            stock = futures[future]
+            ticker = stock["ticker"]
 
-        # Upload chart to storage
-        public_url = upload_chart_to_storage(ticker)
+            print(f"[{idx}/{total_stocks}] {ticker}...", end=" ")
 
-        if public_url is None:
-            print("⚠️  Chart file not found (skipped)")
-            skipped_count += 1
-            continue
+            status, public_url, file_hash = future.result()
 
-        # Update database with URL
-        success = update_stock_chart_url(stock_id, public_url)
+            if status == "missing":
+                print("⚠️  Chart file not found (skipped)")
+                skipped_count += 1
+                continue
+
+            if status == "unchanged":
+                print("⏭️  Unchanged (skipped)")
+                unchanged_count += 1
+                continue
+
+            if status == "failed":
+                print("❌ Upload failed")
+                upload_failed_count += 1
+                continue
 
-        if success:
             print("✅ Uploaded")
-            successful_count += 1
-        else:
-            print("❌ Upload succeeded but database update failed")
-            failed_count += 1
+
+            url_rows.append({
+                "id": stock["id"],
+                "chart_image_url": public_url,
+                "chart_image_hash": file_hash
+            })
+
+    # Update database with URLs
+    print(f"\nSaving {len(url_rows)} chart URLs...")
+    successful_count = save_chart_urls(url_rows)
+    failed_count = upload_failed_count + len(url_rows) - successful_count
 
     # Print summary
     print(f"\n{'='*70}")
@@ -192,9 +272,10 @@ def upload_all_charts():
     print(f"{'='*70}")
     print(f"Total stocks: {total_stocks}")
     print(f"Charts uploaded: {successful_count}")
+    print(f"Unchanged (not re-uploaded): {unchanged_count}")
     print(f"Skipped (no chart file): {skipped_count}")
     print(f"Failed (upload/update errors): {failed_count}")
-    print(f"\n✅ Charts available at: {SUPABASE_URL}/storage/v1/object/public/{BUCKET_NAME}/")
+    print(f"\n✅ Charts available at: {PUBLIC_URL_PREFIX}/")
     print(f"{'='*70}\n")
 
 
@@ -9,36 +9,70 @@ This script:
 - Prints summary report
 """
 
+import multiprocessing as mp
 import os
-from typing import Optional, Tuple, List
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Optional, Tuple, List, Iterator, Any, Dict
 from decimal import Decimal
 
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # Files only, no interactive backend
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import seaborn as sns
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 
+from supabase_cache import cached_rows, paged_select
+
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
 
-load_dotenv()
+# The render pool uses the spawn context, which re-imports this module in
+# every worker; keep import side-effect free so workers never build a
+# Supabase client. The main process creates it on first use.
+_supabase: Optional[Client] = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase() -> Client:
+    """
+    Return the shared Supabase client, creating it on first use.
+    """
+    global _supabase
+
+    with _supabase_lock:
+        if _supabase is None:
+            load_dotenv()
+
+            # One pooled HTTP client shared by PostgREST and Storage, so repeated
+            # requests reuse warm keep-alive connections instead of re-handshaking
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_keepalive_connections=15, max_connections=30, keepalive_expiry=30),
+                timeout=30,
+            )
+            _supabase = create_client(
+                os.environ["SUPABASE_URL"],
+                os.environ["SUPABASE_SERVICE_ROLE_KEY"],
+                options=ClientOptions(httpx_client=http_client),
+            )
 
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+        return _supabase
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 # Constants
 CHART_DIR = "charts"
 MIN_DATA_POINTS = 5  # Skip stocks with fewer data points
+MAX_WORKERS = 8  # Concurrent price data fetches from Supabase
+RENDER_WORKERS = os.cpu_count() or 1  # Chart rendering processes
 POSITIVE_COLOR = "#10b981"  # Green
 NEGATIVE_COLOR = "#ef4444"  # Red
-
-# Ensure charts directory exists
-os.makedirs(CHART_DIR, exist_ok=True)
+CHART_DPI = 100  # Thumbnail resolution for the app
+PNG_COMPRESS_LEVEL = 1  # zlib level: fastest encode, slightly larger files
 
 # ---------------------------------------------------------------------
 # Helper Functions
@@ -46,11 +80,13 @@ os.makedirs(CHART_DIR, exist_ok=True)
 
 def get_all_stocks() -> List[dict]:
     """
-    Fetch all stocks from Supabase.
+    Fetch all stocks from Supabase (cached briefly across scripts).
     Returns list of dicts with id, ticker, name.
     """
-    response = supabase.table("stocks").select("id, ticker, name").execute()
-    return response.data
+    return cached_rows(
+        "stocks:all",
+        lambda: list(paged_select(lambda: get_supabase().table("stocks").select("id, ticker, name").order("id")))
+    )
 
 
 def get_stock_price_data(company_id: int) -> Optional[pd.DataFrame]:
@@ -59,7 +95,7 @@ def get_stock_price_data(company_id: int) -> Optional[pd.DataFrame]:
     Returns DataFrame with date and close_price columns, or None if insufficient data.
     """
     response = (
-        supabase.table("stock_prices")
+        get_supabase().table("stock_prices")
         .select("date, close_price")
         .eq("company_id", company_id)
         .gte("date", "2025-01-01")
@@ -70,9 +106,10 @@ def get_stock_price_data(company_id: int) -> Optional[pd.DataFrame]:
     if not response.data or len(response.data) < MIN_DATA_POINTS:
         return None
 
-    df = pd.DataFrame(response.data)
-    df["date"] = pd.to_datetime(df["date"])
-    df["close_price"] = df["close_price"].astype(float)
+    df = pd.DataFrame(response.data, columns=["date", "close_price"])
+    # Dates are ISO YYYY-MM-DD; an explicit format takes the fast parser path
+    df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d", cache=True)
+    df["close_price"] = pd.to_numeric(df["close_price"])
 
     return df
 
@@ -94,37 +131,75 @@ def calculate_ytd_return(df: pd.DataFrame) -> Optional[float]:
     return ((latest_price - first_price) / first_price) * 100
 
 
-def create_chart(
+def configure_axes(ax: plt.Axes) -> Dict[str, Any]:
+    """
+    Set up the decoration shared by every chart (formatters, locators,
+    labels, grid, legend) and create the artists each chart updates in place.
+    Returns the artists that change per chart.
+    """
+    # Format y-axis as currency
+    ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: f'${y:.2f}'))
+
+    # Format x-axis as month names
+    ax.xaxis_date()
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b'))
+    ax.xaxis.set_major_locator(mdates.MonthLocator())
+
+    # Labels
+    ax.set_xlabel('Date', fontsize=11, fontweight='bold')
+    ax.set_ylabel('Price (CAD)', fontsize=11, fontweight='bold')
+
+    # Main price line, filled per chart
+    (price_line,) = ax.plot([], [], linewidth=2.5, label="Price", zorder=3)
+
+    # Horizontal reference line at starting price
+    start_line = ax.axhline(
+        y=0,
+        color='gray',
+        linestyle='--',
+        linewidth=1,
+        alpha=0.5,
+        label='Starting Price',
+        zorder=1
+    )
+
+    # Grid and legend
+    ax.grid(True, alpha=0.3)
+    legend = ax.legend(loc='upper left', framealpha=0.9)
+
+    return {"price_line": price_line, "start_line": start_line, "legend": legend, "fill": None}
+
+
+def render_chart(
+    ax: plt.Axes,
+    artists: Dict[str, Any],
     ticker: str,
-    name: str,
     df: pd.DataFrame,
     ytd_return: Optional[float],
     current_price: float,
     first_price: float
-) -> str:
+) -> None:
     """
-    Create a professional YTD performance chart.
-    Returns the output file path.
+    Update a configured Axes in place with one stock's YTD performance.
     """
-    sns.set_style("darkgrid")
-    fig, ax = plt.subplots(figsize=(10, 5))
-
     # Determine color based on performance
     is_positive = ytd_return is None or ytd_return >= 0
     line_color = POSITIVE_COLOR if is_positive else NEGATIVE_COLOR
 
-    # Plot the main line
-    ax.plot(
-        df["date"],
-        df["close_price"],
-        color=line_color,
-        linewidth=2.5,
-        label=f"{ticker} Price",
-        zorder=3
-    )
+    # Main line
+    price_line = artists["price_line"]
+    price_line.set_data(df["date"], df["close_price"])
+    price_line.set_color(line_color)
+
+    legend = artists["legend"]
+    legend.legend_handles[0].set_color(line_color)
+    legend.get_texts()[0].set_text(f"{ticker} Price")
 
-    # Fill area under the curve
-    ax.fill_between(
+    # Fill area under the curve (a new collection; fills cannot be reshaped)
+    if artists["fill"] is not None:
+        artists["fill"].remove()
+
+    artists["fill"] = ax.fill_between(
         df["date"],
         df["close_price"],
         alpha=0.3,
@@ -132,27 +207,13 @@ def create_chart(
         zorder=2
     )
 
-    # Add horizontal reference line at starting price
-    ax.axhline(
-        y=first_price,
-        color='gray',
-        linestyle='--',
-        linewidth=1,
-        alpha=0.5,
-        label='Starting Price',
-        zorder=1
-    )
-
-    # Format y-axis as currency
-    ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: f'${y:.2f}'))
-
-    # Format x-axis as month names
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b'))
-    ax.xaxis.set_major_locator(mdates.MonthLocator())
+    # Reference line at starting price
+    artists["start_line"].set_ydata([first_price, first_price])
 
-    # Labels and title
-    ax.set_xlabel('Date', fontsize=11, fontweight='bold')
-    ax.set_ylabel('Price (CAD)', fontsize=11, fontweight='bold')
+    # Rescale to the new data; relim() skips collections, so add the fill's extent
+    ax.relim()
+    ax.update_datalim(artists["fill"].get_datalim(ax.transData).get_points())
+    ax.autoscale_view()
 
     # Title with subtitle
     ytd_str = f"{ytd_return:+.1f}%" if ytd_return is not None else "N/A"
@@ -166,21 +227,78 @@ def create_chart(
         pad=20
     )
 
-    # Grid and legend
-    ax.grid(True, alpha=0.3)
-    ax.legend(loc='upper left', framealpha=0.9)
 
-    # Tight layout
-    plt.tight_layout()
+def create_chart(
+    fig: plt.Figure,
+    ax: plt.Axes,
+    artists: Dict[str, Any],
+    ticker: str,
+    name: str,
+    df: pd.DataFrame,
+    ytd_return: Optional[float],
+    current_price: float,
+    first_price: float
+) -> str:
+    """
+    Redraw the shared figure for one stock and save it.
+    Returns the output file path.
+    """
+    render_chart(ax, artists, ticker, df, ytd_return, current_price, first_price)
 
-    # Save chart
+    # Save chart (layout comes from the figure's constrained layout engine,
+    # so no bbox_inches='tight' pass; fast zlib level trades a few KB for speed)
     output_path = os.path.join(CHART_DIR, f"{ticker}_ytd_chart.png")
-    plt.savefig(output_path, dpi=150, bbox_inches='tight')
-    plt.close()
+    fig.savefig(output_path, dpi=CHART_DPI, pil_kwargs={"compress_level": PNG_COMPRESS_LEVEL})
 
     return output_path
 
 
+# ---------------------------------------------------------------------
+# Render Workers
+# ---------------------------------------------------------------------
+
+# Each render process draws every chart it is given on one reused figure,
+# whose decoration is set up once and whose artists are updated per chart
+_worker_fig: Optional[plt.Figure] = None
+_worker_ax: Optional[plt.Axes] = None
+_worker_artists: Dict[str, Any] = {}
+
+
+def init_render_worker() -> None:
+    """
+    Create and decorate the render process's figure once, when the process starts.
+    """
+    global _worker_fig, _worker_ax, _worker_artists
+
+    sns.set_style("darkgrid")
+    _worker_fig, _worker_ax = plt.subplots(figsize=(10, 5), layout="constrained")
+    _worker_artists = configure_axes(_worker_ax)
+
+
+def render_stock_chart(ticker: str, name: str, df: pd.DataFrame) -> Optional[float]:
+    """
+    Calculate a stock's metrics and save its chart. Runs in a render process.
+    Returns the YTD return.
+    """
+    ytd_return = calculate_ytd_return(df)
+    current_price = df.iloc[-1]["close_price"]
+    first_price = df.iloc[0]["close_price"]
+
+    create_chart(
+        fig=_worker_fig,
+        ax=_worker_ax,
+        artists=_worker_artists,
+        ticker=ticker,
+        name=name,
+        df=df,
+        ytd_return=ytd_return,
+        current_price=current_price,
+        first_price=first_price
+    )
+
+    return ytd_return
+
+
 # ---------------------------------------------------------------------
 # Main Function
 # ---------------------------------------------------------------------
@@ -204,42 +322,60 @@ def visualize_all_stocks():
     print(f"Found {total_stocks} stocks in database.\n")
     print("Generating charts...\n")
 
+    # Ensure charts directory exists
+    os.makedirs(CHART_DIR, exist_ok=True)
+
     # Track statistics
     successful_count = 0
     skipped_count = 0
     failed_count = 0
     ytd_returns = []
 
-    for idx, stock in enumerate(stocks, 1):
-        company_id = stock["id"]
-        ticker = stock["ticker"]
-        name = stock["name"]
-
-        print(f"[{idx}/{total_stocks}] {ticker}...", end=" ")
-
-        try:
-            # Fetch price data
-            df = get_stock_price_data(company_id)
+    # Price fetches are network-bound, so overlap them on a thread pool.
+    # Rendering is CPU-bound and matplotlib is not thread-safe, so each
+    # fetched stock is handed to a process pool as soon as it arrives.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as fetch_executor, ProcessPoolExecutor(
+        max_workers=RENDER_WORKERS,
+        mp_context=mp.get_context("spawn"),
+        initializer=init_render_worker,
+    ) as render_executor:
+        fetch_futures = {fetch_executor.submit(get_stock_price_data, stock["id"]): stock for stock in stocks}
+        render_futures = {}
+        done_count = 0
+
+        for future in as_completed(fetch_futures):
+            stock = fetch_futures[future]
+
+            try:
+                # Fetched price data
+                df = future.result()
+            except Exception as e:
+                done_count += 1
+                print(f"[{done_count}/{total_stocks}] {stock['ticker']}... ❌ Error: {e}")
+                failed_count += 1
+                continue
 
             if df is None:
-                print("⚠️  Insufficient data (skipped)")
+                done_count += 1
+                print(f"[{done_count}/{total_stocks}] {stock['ticker']}... ⚠️  Insufficient data (skipped)")
                 skipped_count += 1
                 continue
 
-            # Calculate metrics
-            ytd_return = calculate_ytd_return(df)
-            current_price = df.iloc[-1]["close_price"]
-            first_price = df.iloc[0]["close_price"]
-
-            # Generate chart
-            output_path = create_chart(
-                ticker=ticker,
-                name=name,
-                df=df,
-                ytd_return=ytd_return,
-                current_price=current_price,
-                first_price=first_price
-            )
+            render_future = render_executor.submit(render_stock_chart, stock["ticker"], stock["name"], df)
+            render_futures[render_future] = stock
+
+        for future in as_completed(render_futures):
+            stock = render_futures[future]
+            done_count += 1
+
+            print(f"[{done_count}/{total_stocks}] {stock['ticker']}...", end=" ")
+
+            try:
+                ytd_return = future.result()
+            except Exception as e:
+                print(f"❌ Error: {e}")
+                failed_count += 1
+                continue
 
             # Track YTD return for summary
             if ytd_return is not None:
@@ -249,11 +385,6 @@ def visualize_all_stocks():
             print(f"✅ {ytd_str}")
             successful_count += 1
 
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            failed_count += 1
-            continue
-
     # Print summary
     print(f"\n{'='*70}")
     print("Summary")
@@ -3,7 +3,7 @@ Generate beautiful YTD performance charts for TSX stocks.
 
 Usage:
     python visualize_stock_performance.py SHOP
-    python visualize_stock_performance.py RY
+    python visualize_stock_performance.py RY --show   # also open the chart in a window
 
 Requirements:
     - matplotlib
@@ -19,6 +19,13 @@ from datetime import datetime
 from typing import Optional, Dict, Any, List
 from pathlib import Path
 
+import matplotlib
+
+# Only open a window when asked; otherwise save headlessly (cron, CI)
+SHOW_CHART = "--show" in sys.argv
+if not SHOW_CHART:
+    matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import seaborn as sns
@@ -26,6 +33,8 @@ import pandas as pd
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from supabase_cache import cached_rows
+
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
@@ -57,18 +66,21 @@ def get_stock_info(ticker: str) -> Optional[Dict[str, Any]]:
         Dict with stock info or None if not found
     """
     try:
-        response = (
-            supabase.table("stocks")
-            .select("id, ticker, name, ytd_return, current_price, first_price_2025")
-            .eq("ticker", ticker.upper())
-            .limit(1)
-            .execute()
+        rows = cached_rows(
+            f"stock_info:{ticker.upper()}",
+            lambda: (
+                supabase.table("stocks")
+                .select("id, ticker, name, ytd_return, current_price, first_price_2025")
+                .eq("ticker", ticker.upper())
+                .limit(1)
+                .execute()
+            ).data
         )
 
-        if not response.data:
+        if not rows:
             return None
 
-        return response.data[0]
+        return rows[0]
 
     except Exception as e:
         print(f"❌ Error fetching stock info: {e}")
@@ -99,9 +111,10 @@ def get_price_data(company_id: int) -> Optional[pd.DataFrame]:
             return None
 
         # Convert to DataFrame
-        df = pd.DataFrame(response.data)
-        df["date"] = pd.to_datetime(df["date"])
-        df["close_price"] = df["close_price"].astype(float)
+        df = pd.DataFrame(response.data, columns=["date", "close_price"])
+        # Dates are ISO YYYY-MM-DD; an explicit format takes the fast parser path
+        df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d", cache=True)
+        df["close_price"] = pd.to_numeric(df["close_price"])
 
         return df
 
@@ -116,7 +129,8 @@ def create_chart(
     df: pd.DataFrame,
     ytd_return: Optional[float],
     current_price: Optional[float],
-    first_price: Optional[float]
+    first_price: Optional[float],
+    show: bool = False
 ) -> str:
     """
     Create a professional YTD performance chart.
@@ -128,6 +142,7 @@ def create_chart(
         ytd_return: YTD return percentage
         current_price: Current/latest price
         first_price: First price in 2025
+        show: Also display the chart in a window
 
     Returns:
         Path to saved chart file
@@ -239,7 +254,10 @@ def create_chart(
     plt.savefig(output_path, dpi=150, bbox_inches='tight')
 
     # Display chart
-    plt.show()
+    if show:
+        plt.show()
+
+    plt.close(fig)
 
     return output_path
 
@@ -253,13 +271,15 @@ def main():
     Main function to generate stock performance chart.
     """
     # Check command line arguments
-    if len(sys.argv) < 2:
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if not args:
         print("❌ Error: Ticker symbol required")
-        print("\nUsage: python visualize_stock_performance.py <TICKER>")
+        print("\nUsage: python visualize_stock_performance.py <TICKER> [--show]")
         print("Example: python visualize_stock_performance.py SHOP")
         sys.exit(1)
 
-    ticker = sys.argv[1].upper()
+    ticker = args[0].upper()
 
     print(f"\n{'='*60}")
     print(f"Generating Chart for {ticker}")
@@ -301,7 +321,8 @@ def main():
         df,
         ytd_return,
         current_price,
-        first_price
+        first_price,
+        show=SHOW_CHART
     )
 
     # Print success message